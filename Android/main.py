@@ -7,31 +7,61 @@ import certifi
 import os
 os.environ['SSL_CERT_FILE'] = certifi.where()
 
-from kivy.app import App, StringProperty
+from kivy.app import App
 from kivy import platform
-from pathlib import Path
 from kivy.lang import Builder
-from kivy.clock import Clock
+from kivy.clock import mainthread
 from kivy.uix.scrollview import ScrollView
 from kivy.core.window import Window 
 from pytube import YouTube,Playlist
-import os.path, threading, pytube
+import pytube, re
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from kivy.properties import StringProperty
+
+# Matches playlist page links like youtube.com/playlist?list=<id>
+PLAYLIST_RE = re.compile(r"/playlist\?(?:[^#]*&)?list=[\w-]+")
+
+def is_playlist(link):
+    return PLAYLIST_RE.search(link) is not None
+
+def drop_page_cache(path):
+    # Flush the finished file and ask the kernel not to keep it cached,
+    # so a large download doesn't evict other apps' pages on mobile
+    if not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fdatasync(fd)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+    except OSError:
+        pass
+
+# Bounded pool so a long playlist doesn't start one thread per video
+download_pool = ThreadPoolExecutor(max_workers=3, thread_name_prefix="download")
+# Link lookups get their own pool so they never wait behind downloads
+info_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="info")
+
 class YtDownloader(ScrollView):
     thumbnail_image_link = StringProperty()
+    last_percent = -1
+    batch_size = 1
+    remaining_downloads = 0
+    failed_downloads = 0
+    details_request = 0
+    download_batch = 0
+    downloading = False
     if platform == 'win':
-        output_path = f'{str(os.path.expanduser("~/Downloads/"))}'
+        output_path = os.path.expanduser("~/Downloads/")
     elif platform == 'android':
         from android.storage import primary_external_storage_path
-        output_path = f'{str(primary_external_storage_path())}/Download/'
+        output_path = f'{primary_external_storage_path()}/Download/'
         from android.permissions import request_permissions, Permission
         request_permissions([Permission.READ_EXTERNAL_STORAGE, Permission.WRITE_EXTERNAL_STORAGE])
     def show_details(self):
-        ytLink = self.ids.link.text
-        Clock.schedule_once(lambda dt: self.update_details(ytLink), 0)
-
-
-    def update_details(self, yt):
         try:
             self.ids.mp4.text = "MP4"
             self.ids.mp3.text = "MP3"
@@ -44,46 +74,106 @@ class YtDownloader(ScrollView):
             self.ids.error_display.text = ""
         except:
             self.show_error("Update details failed")
+        self.details_request += 1
+        # fetching the page blocks on the network, keep it off the UI thread
+        info_pool.submit(self.fetch_details, self.ids.link.text, self.details_request)
+
+    def fetch_details(self, ytLink, request):
         try:
-            ytLink = self.ids.link.text
-            if "playlist" in ytLink:
+            if is_playlist(ytLink):
                 yt = Playlist(ytLink)[0]
                 yt=YouTube(yt)
             else:
                 yt = YouTube(ytLink)
 
-            yt.title = f"{yt.title[0:30]} ..."
-            time = f"{yt.length // 60}m:{(yt.length % 60 if yt.length >= 10 else ('0' + str(yt.length % 60)))}s   {yt.streams.get_highest_resolution().resolution}    {yt.streams.get_highest_resolution().filesize / 1024.0 // 1024}Mb"
-            self.ids.progress_details.opacity = 1
-            self.thumbnail_image_link = str(yt.thumbnail_url)
-            self.ids.Youtube_details.opacity = 1
-            self.ids.yt_title.text = f"{yt.title}"
-            self.ids.yt_details.text = f"{time}"
-            self.ids.thumbnail_image.opacity = 1
-            self.ids.buttons.disabled = False
-            self.ids.mp4.text = "MP4"
-            self.ids.mp4.color = (1,1,1,1)
-            self.ids.mp3.text = "MP3"
-            self.ids.mp3.color = (1,1,1,1)
+            title = yt.title
+            if title[30:]:
+                title = f"{title[:30]} ..."
+            stream = yt.streams.get_highest_resolution()
+            time = f"{yt.length // 60}m:{(yt.length % 60 if yt.length >= 10 else ('0' + str(yt.length % 60)))}s   {stream.resolution}    {stream.filesize / 1024.0 // 1024}Mb"
+            self.update_details(request, title, time, yt.thumbnail_url)
         except pytube.exceptions.RegexMatchError as reg_error:
-            self.show_error("Invalid Link")
+            self.details_failed(request, "Invalid Link")
         except Exception as ex:
-            self.show_error(f"{str(ex)[0:50]}\n{str(ex)[50:]}")
+            self.details_failed(request, f"{str(ex)[0:50]}\n{str(ex)[50:]}")
 
+    @mainthread
+    def details_failed(self, request, message):
+        # a newer link is loading, this error is about the old one
+        if request != self.details_request:
+            return
+        self.show_error(message)
+
+    @mainthread
+    def update_details(self, request, title, time, thumbnail_url):
+        # Download was pressed again while this one was loading
+        if request != self.details_request:
+            return
+        self.ids.progress_details.opacity = 1
+        self.thumbnail_image_link = thumbnail_url
+        self.ids.Youtube_details.opacity = 1
+        self.ids.yt_title.text = title
+        self.ids.yt_details.text = f"{time}"
+        self.ids.thumbnail_image.opacity = 1
+        # a batch still running keeps the buttons locked until it finishes
+        self.ids.buttons.disabled = self.downloading
+        self.ids.mp4.text = "MP4"
+        self.ids.mp4.color = (1,1,1,1)
+        self.ids.mp3.text = "MP3"
+        self.ids.mp3.color = (1,1,1,1)
 
+    @mainthread
     def show_error(self, message):
         self.ids.error_display.text = message
         self.ids.error_display.color = (1, 0, 0, 0.85)
 
-    def progress_check(self, stream, chunk, bytes_remaining):
+    def progress_check(self, batch, stream, chunk, bytes_remaining):
+        # playlists show how many videos are done instead of per-file progress
+        if batch != self.download_batch or self.batch_size > 1:
+            return
         try:
-            value = round((1 - bytes_remaining / stream.filesize) * 100, 1)
-            self.ids.progressbar.value = value
-            self.ids.p_percent.text = f"{int(value)}%"
+            # only touch the widgets when the whole percentage changes
+            value = int((1 - bytes_remaining / stream.filesize) * 100)
+            if value == self.last_percent:
+                return
+            self.last_percent = value
+            self.show_progress(value)
         except Exception as ex:
             self.show_error("progress check error")
 
-    def complete_func(self, *args):
+    @mainthread
+    def show_progress(self, value):
+        self.ids.progressbar.value = value
+        self.ids.p_percent.text = f"{value}%"
+
+    @mainthread
+    def count_download(self, batch, button_id, ok):
+        if batch != self.download_batch:
+            return
+        self.remaining_downloads -= 1
+        if not ok:
+            self.failed_downloads += 1
+        if self.batch_size > 1:
+            self.show_progress(int((1 - self.remaining_downloads / self.batch_size) * 100))
+        if self.remaining_downloads == 0:
+            self.download_finished(button_id)
+
+    def download_finished(self, button_id):
+        # only re-enable once every queued video is done, so a playlist can't be queued twice
+        self.ids.mp4.text = "MP4"
+        self.ids.mp4.color = (1,1,1,1)
+        self.ids.mp3.text = "MP3"
+        self.ids.mp3.color = (1,1,1,1)
+        if not self.failed_downloads:
+            self.ids[button_id].text = "Downloaded"
+            self.ids[button_id].color = (0,1,0,0.8)
+        self.downloading = False
+        self.ids.buttons.disabled = False
+
+    @mainthread
+    def complete_func(self, batch, *args):
+        if batch != self.download_batch or self.batch_size > 1:
+            return
         try:
             self.ids.progressbar.value = 100
             self.ids.p_percent.text = "100%"
@@ -93,60 +183,64 @@ class YtDownloader(ScrollView):
         
 
     def MP4download(self):
+        self.start_downloads("mp4")
+
+    def MP3download(self):
+        self.start_downloads("mp3")
+
+    def start_downloads(self, kind):
         self.ids.progressbar.value = 0
         self.ids.p_percent.text = "0%"
+        self.last_percent = -1
         self.ids.error_display.text = ""
-        self.ids.mp3.text = "MP3"
         self.ids.mp4.text = "MP4"
+        self.ids.mp3.text = "MP3"
         self.ids.buttons.disabled = True
         self.ids.buttons.color = (1,1,1,1)
-        ytLink = self.ids.link.text
-        if "playlist" in ytLink:
-            videos=Playlist(ytLink).video_urls
-        else:
-            videos=[str(ytLink)]
-        for video in videos:
-            threading.Thread(target=self.thread_mp4(video)).start()
+        self.downloading = True
+        # callbacks from an earlier batch compare against this and drop out
+        self.download_batch += 1
+        download_pool.submit(self.queue_videos, self.download_batch, self.ids.link.text, kind)
 
-    def thread_mp4(self,video4):
+    def queue_videos(self, batch, ytLink, kind):
+        # listing a playlist fetches its pages, keep that off the UI thread too
         try:
-            yt = YouTube(video4, on_progress_callback=self.progress_check, on_complete_callback=self.complete_func)
-            stream = yt.streams.filter(progressive=True).get_highest_resolution()
-            stream.download(self.output_path, filename=f"{stream.default_filename.replace(' ','_')}")
-            self.ids.mp4.text = "Downloaded"
-            self.ids.mp4.color = (0,1,0,0.8)
-            self.ids.mp3.text = "MP3"
-            self.ids.mp3.color = (1,1,1,1)
-            self.ids.buttons.disabled = False
+            if is_playlist(ytLink):
+                videos=list(Playlist(ytLink).video_urls)
+            else:
+                videos=[ytLink]
         except Exception as ex:
             self.show_error(f"{str(ex)[0:50]}\n{str(ex)[50:]}")
+            videos=[]
+        self.submit_videos(batch, videos, kind)
 
-    def MP3download(self):
-        self.ids.progressbar.value = 0
-        self.ids.p_percent.text = "0%"
-        self.ids.error_display.text = ""
-        self.ids.mp4.text = "MP4"
-        self.ids.mp3.text = "MP3"
-        self.ids.buttons.disabled = True
-        ytLink = self.ids.link.text
-        if "playlist" in ytLink:
-            videos3=Playlist(ytLink).video_urls
-        else:
-            videos3=[str(ytLink)]
-        for video3 in videos3:
-            threading.Thread(target=self.thread_mp3(video3)).start()
-    def thread_mp3(self,video33):
+    @mainthread
+    def submit_videos(self, batch, videos, kind):
+        if batch != self.download_batch:
+            return
+        self.batch_size = self.remaining_downloads = len(videos)
+        self.failed_downloads = 0 if videos else 1
+        if not videos:
+            self.download_finished(kind)
+            return
+        for video in videos:
+            download_pool.submit(self.download_thread, batch, video, kind)
+
+    def download_thread(self, batch, video, kind):
         try:
-            yt = YouTube(video33, on_progress_callback=self.progress_check, on_complete_callback=self.complete_func)
-            stream = yt.streams.filter(only_audio=True).first()
-            stream.download(self.output_path, filename=f"{stream.default_filename[:-4].replace(' ','_')}.mp3")
-            self.ids.mp3.text = "Downloaded"
-            self.ids.mp3.color = (0,1,0,0.8)
-            self.ids.mp4.text = "MP4"
-            self.ids.mp4.color = (1,1,1,1)
-            self.ids.buttons.disabled = False
+            yt = YouTube(video, on_progress_callback=partial(self.progress_check, batch), on_complete_callback=partial(self.complete_func, batch))
+            if kind == "mp4":
+                stream = yt.streams.get_highest_resolution()
+                filename = stream.default_filename.replace(' ','_')
+            else:
+                stream = yt.streams.get_audio_only()
+                filename = f"{stream.default_filename[:-4].replace(' ','_')}.mp3"
+            path = stream.download(self.output_path, filename=filename)
+            drop_page_cache(path)
+            self.count_download(batch, kind, True)
         except Exception as ex:
             self.show_error(f"{str(ex)[0:50]}\n{str(ex)[50:]}")
+            self.count_download(batch, kind, False)
 
 class YoutubeDownloader(App):
     def build(self):
@@ -156,9 +250,14 @@ class YoutubeDownloader(App):
         return YtDownloader()
     def on_start(self):
         try:
-            os.mkdir(self.output_path)
+            output_path = self.root.output_path
+            if not os.path.isdir(output_path):
+                os.makedirs(output_path)
         except:
             pass
+    def on_stop(self):
+        download_pool.shutdown(wait=False, cancel_futures=True)
+        info_pool.shutdown(wait=False, cancel_futures=True)
 
 
 if __name__ == "__main__":
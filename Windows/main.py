@@ -5,141 +5,264 @@ import customtkinter as cust
 from pytubefix import YouTube as youtubefix
 from pytubefix import Playlist as playlistfix
 from PIL import Image
-from io import BytesIO
-import os, requests, threading
+import os, re, requests, threading
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Shared HTTP session so thumbnail fetches reuse the keep-alive connection
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16,
+	max_retries=Retry(total=2, backoff_factor=0.3)))
+# Default blue button colour (light, dark) restored after a link loads
+BUTTON_COLOR = ("#3a7ebf", "#1f538d")
+# Resized thumbnails are kept on disk by video id, newest 500 only
+THUMB_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "ytdl_thumbs")
+THUMB_CACHE_SIZE = 500
+VIDEO_ID_RE = re.compile(r"/vi(?:_webp)?/([^/]+)/")
+# Matches playlist page links like youtube.com/playlist?list=<id>
+PLAYLIST_RE = re.compile(r"/playlist\?(?:[^#]*&)?list=[\w-]+")
+thumb_cache_lock = threading.Lock()
+# Bounded pool so a long playlist doesn't start one thread per video
+download_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="download")
+# YouTube objects from show_details, reused by the download buttons
+INFO_TTL = 600
+info_cache = {}
+info_cache_lock = threading.Lock()
 
 # Functions
 def resource_path(relative_path):
 	""" Get absolute path to resource, works for dev and for PyInstaller """
 	base_path = getattr(sys, '_MEIPASS', os.path.dirname(os.path.abspath(__file__)))
 	return os.path.join(base_path, relative_path)
+def thumb_cache_path(url):
+	match = VIDEO_ID_RE.search(url)
+	return os.path.join(THUMB_CACHE_DIR, f"{match.group(1)}.jpg") if match else None
+def save_thumbnail(img, path):
+	# details load on worker threads, write via a temp file so readers never see a partial jpeg
+	with thumb_cache_lock:
+		try:
+			os.makedirs(THUMB_CACHE_DIR, exist_ok=True)
+			img.save(f"{path}.tmp", "JPEG", quality=80)
+			os.replace(f"{path}.tmp", path)
+			entries = sorted(os.scandir(THUMB_CACHE_DIR), key=lambda entry: entry.stat().st_mtime)
+			for entry in entries[:-THUMB_CACHE_SIZE]:
+				os.remove(entry.path)
+		except OSError:
+			pass
+def is_playlist(url):
+	# only the playlist page itself, watch/youtu.be/shorts links with list= are single videos
+	return PLAYLIST_RE.search(url) is not None
+def cached_youtube(url):
+	yt = youtubefix(url)
+	# lookups and downloads run on several threads at once
+	with info_cache_lock:
+		now = monotonic()
+		for key in [key for key, (added, _) in info_cache.items() if now - added >= INFO_TTL]:
+			del info_cache[key]
+		info_cache[url] = (now, yt)
+	return yt
+def youtube_for_download(url, on_progress):
+	with info_cache_lock:
+		entry = info_cache.get(url)
+	if entry and monotonic() - entry[0] < INFO_TTL:
+		yt = entry[1]
+		yt.register_on_progress_callback(on_progress)
+		return yt
+	return youtubefix(url, on_progress_callback=on_progress)
+def preview_thumbnail_url(url):
+	# mqdefault (320x180) is the smallest 16:9 thumbnail that still covers the 190x100 preview
+	match = VIDEO_ID_RE.search(url)
+	return f"https://i.ytimg.com/vi/{match.group(1)}/mqdefault.jpg" if match else url
 def url_to_image(url):
+	# returns (image, None) or (None, reason) so the caller can show why it failed
+	preview_url = preview_thumbnail_url(url)
+	cache_path = thumb_cache_path(preview_url)
+	if cache_path and os.path.exists(cache_path):
+		try:
+			img = Image.open(cache_path)
+			img.load()
+			os.utime(cache_path)
+			return img, None
+		except OSError:
+			pass
 	try:
-		response = requests.get(url)
-		if response.status_code == 200:
-			img = Image.open(BytesIO(response.content))
-			img = img.resize((190,100))
-			return img
-		else:
-			finishLabel.configure(text=f"Failed to retrieve Thumbnail.\nError {response.status_code}!!")
-			return None
+		# not every video has an mqdefault, fall back to the url pytube gave us once
+		for candidate in dict.fromkeys((preview_url, url)):
+			with _SESSION.get(candidate, timeout=5, stream=True) as response:
+				if response.status_code != 200:
+					continue
+				response.raw.decode_content = True
+				img = Image.open(response.raw)
+				img = img.convert("RGB").resize((190,100), Image.Resampling.BILINEAR)
+				if cache_path:
+					save_thumbnail(img, cache_path)
+				return img, None
+		return None, f"Failed to retrieve Thumbnail.\nError {response.status_code}!!"
 	except Exception as e:
-		finishLabel.configure(text=f"An error occurred: {e}")
-		return None
+		return None, f"An error occurred: {e}"
 downloads_path = os.path.expanduser("~/Downloads")
-def show_details():
+def reset_ui(message="", color="red"):
 	p_percent.configure(text="0%")
 	progressbar.set(0)
 	mp4button.configure(text="", state="disabled", fg_color="transparent")
 	mp3button.configure(text="", state="disabled", fg_color="transparent")
-	finishLabel.configure(text="")
+	finishLabel.configure(text=message, text_color=color)
 	video_label.configure(text="")
 	thumbnail_label.configure(text="",image=None)
-	ytLink = link_input.get()
-	# check weather the link is playlist link or video link
-	if "playlist" in ytLink:
-		try:
-			yt = playlistfix(ytLink)
-			temp_img = url_to_image(str(yt.videos[0].thumbnail_url))
-			time = str(f"{yt.length} videos in this playlist\nAll will be Downloaded")
-			video_label.configure(text=time, text_color="white", justify="left")
-			if temp_img:
-				thumbnail = cust.CTkImage(light_image=temp_img,dark_image=temp_img, size=(190,100))
-				thumbnail_label.configure(image=thumbnail)
-				mp4button.configure(text="MP4", state="normal", fg_color=["#3a7ebf", "#1f538d"], text_color="white")
-				mp3button.configure(text="MP3", state="normal", fg_color=["#3a7ebf", "#1f538d"], text_color="white")
-			else:
-				finishLabel.configure(text="No Internet", text_color="red")
-				pass
-		except Exception as ex:
-			p_percent.configure(text="0%")
-			progressbar.set(0)
-			mp4button.configure(text="", state="disabled", fg_color="transparent")
-			mp3button.configure(text="", state="disabled", fg_color="transparent")
-			finishLabel.configure(text="Invalid Link", text_color="red")
-			video_label.configure(text="")
-			thumbnail_label.configure(text="",image=None)
-	else:
-		try:
-			yt = youtubefix(ytLink)
-			time = str(f"{yt.length//60}m:{(yt.length%60 if yt.length>=10 else ('0'+str(yt.length%60)))}s {yt.streams.get_highest_resolution().resolution}")
-			temp_img = url_to_image(yt.thumbnail_url)
-			video_label.configure(text=f"{yt.title}\n{time}", text_color="white", justify="left")
-			if temp_img:
-				thumbnail = cust.CTkImage(light_image=temp_img,dark_image=temp_img, size=(190,100))
-				thumbnail_label.configure(image=thumbnail)
-				mp4button.configure(text="MP4", state="normal", fg_color=["#3a7ebf", "#1f538d"], text_color="white")
-				mp3button.configure(text="MP3", state="normal", fg_color=["#3a7ebf", "#1f538d"], text_color="white")
-			else:
-				finishLabel.configure(text="No Internet", text_color="red")
-				pass
-		except Exception as ex:
-			print(ex)
-			p_percent.configure(text="0%")
-			progressbar.set(0)
-			mp4button.configure(text="", state="disabled", fg_color="transparent")
-			mp3button.configure(text="", state="disabled", fg_color="transparent")
-			finishLabel.configure(text="Invalid Link", text_color="red")
-			video_label.configure(text="")
-			thumbnail_label.configure(text="",image=None)
-
-def MP4download():
+	# draw the cleared state in one pass before any slow work starts
+	app.update_idletasks()
+def reset_download_ui():
 	p_percent.configure(text="0%")
 	progressbar.set(0)
 	finishLabel.configure(text="")
 	mp4button.configure(text="MP4", text_color = "white", state="disabled")
 	mp3button.configure(text="MP3", text_color = "white", state="disabled")
-	def download_thread(video):
-		try:
-			yt = youtubefix(video, on_progress_callback=progress_check,on_complete_callback=complete)
-			stream = yt.streams.filter(progressive=True).get_highest_resolution()
-			stream.download(downloads_path, filename=f"{stream.default_filename.replace(' ','_')}")
-			mp4button.configure(text="Downloaded", text_color = "lime", state="normal")
-			mp3button.configure(text="MP3", text_color = "white", state="normal")
-		except Exception as ex:
-			finishLabel.configure(text=f"{ex}",text_color="red")
+details_request = 0
+def show_details():
+	global details_request
+	details_request += 1
+	reset_ui("Loading...", "white")
 	ytLink = link_input.get()
-	if "playlist" in ytLink:
-		videos=playlistfix(ytLink).video_urls
+	# the page fetch and thumbnail decode would freeze the window, do them on a worker
+	threading.Thread(target=load_details, args=(ytLink, details_request), daemon=True).start()
+def load_details(ytLink, request):
+	try:
+		# check weather the link is playlist link or video link
+		if is_playlist(ytLink):
+			yt = playlistfix(ytLink)
+			temp_img, error = url_to_image(yt.videos[0].thumbnail_url)
+			text = f"{yt.length} videos in this playlist\nAll will be Downloaded"
+		else:
+			yt = cached_youtube(ytLink)
+			time = f"{yt.length//60}m:{(yt.length%60 if yt.length>=10 else ('0'+str(yt.length%60)))}s {yt.streams.get_highest_resolution().resolution}"
+			temp_img, error = url_to_image(yt.thumbnail_url)
+			text = f"{yt.title}\n{time}"
+	except Exception as ex:
+		app.after(0, apply_details, request, None, None, f"{ex}")
+		return
+	app.after(0, apply_details, request, text, temp_img, error)
+def apply_details(request, text, temp_img, error):
+	# Download was clicked again while this one was loading
+	if request != details_request:
+		return
+	if text is None:
+		reset_ui(error or "Invalid Link")
+		return
+	video_label.configure(text=text, text_color="white", justify="left")
+	if temp_img:
+		finishLabel.configure(text="")
+		thumbnail = cust.CTkImage(light_image=temp_img,dark_image=temp_img, size=(190,100))
+		thumbnail_label.configure(image=thumbnail)
+		# a batch still running keeps the buttons locked until it finishes
+		state = "disabled" if downloading else "normal"
+		mp4button.configure(text="MP4", state=state, fg_color=BUTTON_COLOR, text_color="white")
+		mp3button.configure(text="MP3", state=state, fg_color=BUTTON_COLOR, text_color="white")
 	else:
-		videos=[str(ytLink)]
-	for video in videos:
-		threading.Thread(target=download_thread(video)).start()
+		finishLabel.configure(text=error, text_color="red")
 
+def MP4download():
+	reset_download_ui()
+	start_downloads(download_mp4, mp4button)
 def MP3download():
-	p_percent.configure(text="0%")
-	progressbar.set(0)
-	finishLabel.configure(text="")
-	mp4button.configure(text="MP4", text_color = "white", state="disabled")
-	mp3button.configure(text="MP3", text_color = "white", state="disabled")
-	def download_thread(video33):
+	reset_download_ui()
+	start_downloads(download_mp3, mp3button)
+def download_mp4(video, on_progress):
+	try:
+		yt = youtube_for_download(video, on_progress)
+		stream = yt.streams.get_highest_resolution()
+		stream.download(downloads_path, filename=f"{stream.default_filename.replace(' ','_')}")
+		return True
+	except Exception as ex:
+		error = f"{ex}"
+		app.after(0, lambda: finishLabel.configure(text=error,text_color="red"))
+		return False
+def download_mp3(video33, on_progress):
+	try:
+		yt = youtube_for_download(video33, on_progress)
+		stream = yt.streams.get_audio_only()
+		stream.download(downloads_path, filename=f"{stream.default_filename.replace(' ','_')}.mp3")
+		return True
+	except Exception as ex:
+		error = f"{ex}"
+		app.after(0, lambda: finishLabel.configure(text=error,text_color="red"))
+		return False
+download_batch = 0
+downloading = False
+def start_downloads(download_thread, done_button):
+	global download_batch, downloading
+	# callbacks from an earlier batch compare against this and drop out
+	download_batch += 1
+	downloading = True
+	batch = download_batch
+	ytLink = link_input.get()
+	batch_size = remaining = failed = 0
+	def queue_videos():
+		# listing a playlist fetches its pages, keep that off the Tk thread too
 		try:
-			yt = youtubefix(video33, on_progress_callback=progress_check,on_complete_callback=complete)
-			stream = yt.streams.filter(only_audio=True).first()
-			stream.download(downloads_path, filename=f"{stream.default_filename.replace(' ','_')}.mp3")
-			mp4button.configure(text="MP4", text_color = "white", state="normal")
-			mp3button.configure(text="Downloaded", text_color = "lime", state="normal")
+			videos = list(playlistfix(ytLink).video_urls) if is_playlist(ytLink) else [ytLink]
 		except Exception as ex:
-			finishLabel.configure(text=f"{ex}")
-	ytLink = link_input.get()
-	if "playlist" in ytLink:
-		videos3=playlistfix(ytLink).video_urls
-	else:
-		videos3=[str(ytLink)]
-	for video3 in videos3:
-		threading.Thread(target=download_thread(video3)).start()
+			error = f"{ex}"
+			app.after(0, lambda: (finishLabel.configure(text=error,text_color="red"), submit_videos([])))
+			return
+		app.after(0, submit_videos, videos)
+	def submit_videos(videos):
+		nonlocal batch_size, remaining, failed
+		if batch != download_batch:
+			return
+		batch_size = remaining = len(videos)
+		failed = 0 if videos else 1
+		if not videos:
+			finish_downloads()
+			return
+		for video in videos:
+			download_pool.submit(download_thread, video, video_progress).add_done_callback(video_finished)
+	def video_progress(stream, chunk, bytes_remaining):
+		# playlists show how many videos are done instead of per-file progress
+		if batch == download_batch and batch_size == 1:
+			progress_check(stream, chunk, bytes_remaining)
+	def video_finished(future):
+		# runs on the worker, hand the result to the Tk thread
+		if not future.cancelled():
+			app.after(0, count_video, future.result())
+	def count_video(ok):
+		nonlocal remaining, failed
+		if batch != download_batch:
+			return
+		remaining -= 1
+		if not ok:
+			failed += 1
+		if batch_size > 1:
+			done = (batch_size - remaining) / batch_size
+			progressbar.set(done)
+			p_percent.configure(text=f"{int(done*100)}%")
+		if remaining == 0:
+			finish_downloads()
+	def finish_downloads():
+		global downloading
+		# only re-enable once every queued video is done, so a playlist can't be queued twice
+		downloading = False
+		mp4button.configure(text="MP4", text_color = "white", state="normal")
+		mp3button.configure(text="MP3", text_color = "white", state="normal")
+		if not failed:
+			done_button.configure(text="Downloaded", text_color = "lime")
+	# its own thread, so the lookup doesn't wait behind videos already in the pool
+	threading.Thread(target=queue_videos, daemon=True).start()
+last_progress_update = 0.0
 def progress_check(stream, chunk, bytes_remaining):
+	global last_progress_update
+	# called from the download thread for every chunk, redraw at most ~15 times a second
+	now = monotonic()
+	if now - last_progress_update < 0.066 and bytes_remaining > 0:
+		return
+	last_progress_update = now
 	total_size = stream.filesize
 	bytes_downloaded = total_size - bytes_remaining
 	percentage_of_completion = bytes_downloaded / total_size * 100
-	# update progress bar
-	progressbar.set(percentage_of_completion/100)
-	# update percentage label
-	p_percent.configure(text=f"{int(percentage_of_completion)}%")
-	p_percent.update()
-def complete(downloaded_stream, path_stream):
-	progressbar.set(1)
-	p_percent.configure(text="100%")
+	# update progress bar and percentage label on the Tk thread
+	app.after(0, lambda: (progressbar.set(percentage_of_completion/100),
+		p_percent.configure(text=f"{int(percentage_of_completion)}%")))
 
 # system settings
 cust.set_appearance_mode("System")
@@ -199,3 +322,4 @@ progressbar.pack()
 app.minsize(360,450)
 if __name__ == "__main__":
 	app.mainloop()
+	download_pool.shutdown(wait=False, cancel_futures=True)